@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+from collections.abc import Iterable
 from collections.abc import Sequence
 
+import numpy as np
 import pyarrow as pa
 
+from osmpq.osm.types import DenseNodeColumns
 from osmpq.osm.types import OsmNode
 from osmpq.osm.types import OsmRelation
 from osmpq.osm.types import OsmTags
@@ -11,6 +14,8 @@ from osmpq.osm.types import OsmWay
 
 ARROW_TAG_FIELD = pa.map_(pa.string(), pa.string())
 
+ARROW_USER_SID_FIELD = pa.dictionary(pa.int32(), pa.string())
+
 ARROW_NODE_FIELDS = [
     pa.field("id", pa.int64()),
     pa.field("version", pa.int32()),
@@ -20,7 +25,7 @@ ARROW_NODE_FIELDS = [
     pa.field("timestamp", pa.int64()),
     pa.field("changeset", pa.int64()),
     pa.field("uid", pa.int64()),
-    pa.field("user_sid", pa.string()),
+    pa.field("user_sid", ARROW_USER_SID_FIELD),
 ]
 
 ARROW_NODE_SCHEMA = pa.schema(ARROW_NODE_FIELDS)
@@ -34,7 +39,7 @@ ARROW_WAY_FIELD = [
     pa.field("timestamp", pa.int64()),
     pa.field("changeset", pa.int64()),
     pa.field("uid", pa.int64()),
-    pa.field("user_sid", pa.string()),
+    pa.field("user_sid", ARROW_USER_SID_FIELD),
 ]
 
 
@@ -59,109 +64,271 @@ ARROW_RELATION_FIELDS = [
     pa.field("timestamp", pa.int64()),
     pa.field("changeset", pa.int64()),
     pa.field("uid", pa.int64()),
-    pa.field("user_sid", pa.string()),
+    pa.field("user_sid", ARROW_USER_SID_FIELD),
 ]
 
 ARROW_RELATION_SCHEMA = pa.schema(ARROW_RELATION_FIELDS)
 
 
-def _get_tags_array(tags: OsmTags) -> Sequence[tuple[str, str]]:
-    return list(tags.items())
+def _optional_array(values: np.ndarray, type: pa.DataType) -> pa.Array:
+    # Absent info values are stored as zero
+    return pa.array(values, mask=values == 0, type=type)
 
 
-def record_batch_for_nodes(nodes: Sequence[OsmNode]) -> pa.RecordBatch | None:
-    if not nodes:
-        return None
+def _null_mask(nulls: np.ndarray) -> pa.Array | None:
+    return pa.array(nulls, type=pa.bool_()) if nulls.any() else None
+
+
+class _TagsBuilder:
+    def __init__(self, count: int) -> None:
+        self.offsets = np.zeros(count + 1, dtype=np.int32)
+        self.nulls = np.zeros(count, dtype=np.bool_)
+        self.keys: list[str] = []
+        self.values: list[str] = []
+
+    def append(self, index: int, tags: OsmTags | None) -> None:
+        if tags is None:
+            self.nulls[index] = True
+        else:
+            self.keys.extend(tags.keys())
+            self.values.extend(tags.values())
+        self.offsets[index + 1] = len(self.keys)
+
+    def finish(self) -> pa.Array:
+        return pa.MapArray.from_arrays(
+            pa.array(self.offsets, type=pa.int32()),
+            pa.array(self.keys, type=pa.string()),
+            pa.array(self.values, type=pa.string()),
+            type=ARROW_TAG_FIELD,
+            mask=_null_mask(self.nulls),
+        )
+
+
+class _DictionaryBuilder:
+    def __init__(self, count: int) -> None:
+        self.indices = np.zeros(count, dtype=np.int32)
+        self.nulls = np.zeros(count, dtype=np.bool_)
+        self.lookup: dict[str, int] = {}
+
+    def append(self, index: int, value: str | None) -> None:
+        if value is None:
+            self.nulls[index] = True
+        else:
+            self.indices[index] = self.lookup.setdefault(value, len(self.lookup))
+
+    def finish(self) -> pa.Array:
+        return pa.DictionaryArray.from_arrays(
+            pa.array(self.indices, mask=self.nulls, type=pa.int32()),
+            pa.array(list(self.lookup), type=pa.string()),
+        )
+
+
+def _members_array(
+    offsets: np.ndarray, ids: list[int], roles: list[str], types: list[str], nulls: np.ndarray
+) -> pa.Array:
+    values = pa.StructArray.from_arrays(
+        [
+            pa.array(ids, type=pa.int64()),
+            pa.array(roles, type=pa.string()),
+            pa.array(types, type=pa.string()),
+        ],
+        fields=list(ARROW_RELATION_MEMBERS_FIELD.value_type),
+    )
+    return pa.ListArray.from_arrays(
+        pa.array(offsets, type=pa.int32()),
+        values,
+        type=ARROW_RELATION_MEMBERS_FIELD,
+        mask=_null_mask(nulls),
+    )
+
+
+def _check_count(kind: str, expected: int, actual: int) -> None:
+    if actual != expected:
+        raise ValueError(f"Expected {expected} {kind}, but decoded {actual}")
 
-    ids = [node.id for node in nodes]
-    versions = [node.info.version for node in nodes]
-    latitudes = [node.latitude for node in nodes]
-    longitudes = [node.longitude for node in nodes]
-    timestamps = [node.info.timestamp for node in nodes]
-    changesets = [node.info.changeset for node in nodes]
-    uids = [node.info.uid for node in nodes]
-    user_sids = [node.info.user_sid for node in nodes]
 
-    tags: list[Sequence[tuple[str, str]] | None] = [None] * len(nodes)
+def record_batch_for_nodes(nodes: Iterable[OsmNode], count: int) -> pa.RecordBatch | None:
+    if count == 0:
+        return None
+
+    ids = np.empty(count, dtype=np.int64)
+    versions = np.empty(count, dtype=np.int32)
+    latitudes = np.empty(count, dtype=np.float64)
+    longitudes = np.empty(count, dtype=np.float64)
+    timestamps = np.empty(count, dtype=np.int64)
+    changesets = np.empty(count, dtype=np.int64)
+    uids = np.empty(count, dtype=np.int64)
+    user_sids = _DictionaryBuilder(count)
+    tags = _TagsBuilder(count)
+
+    i = -1
     for i, node in enumerate(nodes):
-        if node.tags is not None:
-            tags[i] = _get_tags_array(node.tags)
+        info = node.info
+        ids[i] = node.id
+        versions[i] = info.version or 0
+        latitudes[i] = node.latitude
+        longitudes[i] = node.longitude
+        timestamps[i] = info.timestamp or 0
+        changesets[i] = info.changeset or 0
+        uids[i] = info.uid or 0
+        user_sids.append(i, info.user_sid)
+        tags.append(i, node.tags)
+    _check_count("nodes", count, i + 1)
 
     arrays = [
         pa.array(ids, type=pa.int64()),
-        pa.array(versions, type=pa.int32()),
-        pa.array(tags, type=ARROW_TAG_FIELD),
+        _optional_array(versions, type=pa.int32()),
+        tags.finish(),
         pa.array(latitudes, type=pa.float64()),
         pa.array(longitudes, type=pa.float64()),
-        pa.array(timestamps, type=pa.int64()),
-        pa.array(changesets, type=pa.int64()),
-        pa.array(uids, type=pa.int64()),
-        pa.array(user_sids, type=pa.string()),
+        _optional_array(timestamps, type=pa.int64()),
+        _optional_array(changesets, type=pa.int64()),
+        _optional_array(uids, type=pa.int64()),
+        user_sids.finish(),
     ]
     return pa.RecordBatch.from_arrays(arrays, schema=ARROW_NODE_SCHEMA)
 
 
-def record_batch_for_ways(ways: Sequence[OsmWay]) -> pa.RecordBatch | None:
-    if not ways:
+def _dense_node_batch(columns: DenseNodeColumns, string_table: pa.Array) -> pa.RecordBatch:
+    offsets = columns.tag_offsets
+    tags = pa.MapArray.from_arrays(
+        pa.array(offsets, type=pa.int32()),
+        string_table.take(pa.array(columns.tag_keys, type=pa.int32())),
+        string_table.take(pa.array(columns.tag_values, type=pa.int32())),
+        type=ARROW_TAG_FIELD,
+        mask=_null_mask(offsets[1:] == offsets[:-1]),
+    )
+
+    user_sid_values, user_sid_indices = np.unique(columns.user_sids, return_inverse=True)
+    user_sids = pa.DictionaryArray.from_arrays(
+        pa.array(user_sid_indices.astype(np.int32), mask=columns.user_sids == 0, type=pa.int32()),
+        string_table.take(pa.array(user_sid_values, type=pa.int32())),
+    )
+
+    arrays = [
+        pa.array(columns.ids, type=pa.int64()),
+        _optional_array(columns.versions, type=pa.int32()),
+        tags,
+        pa.array(columns.latitudes, type=pa.float64()),
+        pa.array(columns.longitudes, type=pa.float64()),
+        _optional_array(columns.timestamps, type=pa.int64()),
+        _optional_array(columns.changesets, type=pa.int64()),
+        _optional_array(columns.uids, type=pa.int64()),
+        user_sids,
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=ARROW_NODE_SCHEMA)
+
+
+def record_batch_for_node_groups(
+    groups: Iterable[Sequence[OsmNode] | DenseNodeColumns], string_table: Sequence[str]
+) -> pa.RecordBatch | None:
+    batches = []
+    table: pa.Array | None = None
+    for group in groups:
+        if isinstance(group, DenseNodeColumns):
+            if table is None:
+                table = pa.array(string_table, type=pa.string())
+            batches.append(_dense_node_batch(group, table))
+        else:
+            batches.append(record_batch_for_nodes(group, len(group)))
+    return concat_record_batches(batches)
+
+
+def concat_record_batches(batches: Sequence[pa.RecordBatch | None]) -> pa.RecordBatch | None:
+    present = [batch for batch in batches if batch is not None]
+    if not present:
+        return None
+    if len(present) == 1:
+        return present[0]
+    return pa.concat_batches(present)
+
+
+def record_batch_for_ways(ways: Iterable[OsmWay], count: int) -> pa.RecordBatch | None:
+    if count == 0:
         return None
 
-    ids = [way.id for way in ways]
-    versions = [way.info.version for way in ways]
-    nodes = [way.nodes for way in ways]
-    timestamps = [way.info.timestamp for way in ways]
-    changesets = [way.info.changeset for way in ways]
-    uids = [way.info.uid for way in ways]
-    user_sids = [way.info.user_sid for way in ways]
+    ids = np.empty(count, dtype=np.int64)
+    versions = np.empty(count, dtype=np.int32)
+    timestamps = np.empty(count, dtype=np.int64)
+    changesets = np.empty(count, dtype=np.int64)
+    uids = np.empty(count, dtype=np.int64)
+    user_sids = _DictionaryBuilder(count)
+    nodes: list[list[int]] = [[]] * count
+    tags = _TagsBuilder(count)
 
-    tags: list[Sequence[tuple[str, str]] | None] = [None] * len(ways)
+    i = -1
     for i, way in enumerate(ways):
-        if way.tags is not None:
-            tags[i] = _get_tags_array(way.tags)
+        info = way.info
+        ids[i] = way.id
+        versions[i] = info.version or 0
+        nodes[i] = way.nodes
+        timestamps[i] = info.timestamp or 0
+        changesets[i] = info.changeset or 0
+        uids[i] = info.uid or 0
+        user_sids.append(i, info.user_sid)
+        tags.append(i, way.tags)
+    _check_count("ways", count, i + 1)
 
     arrays = [
         pa.array(ids, type=pa.int64()),
-        pa.array(versions, type=pa.int32()),
-        pa.array(tags, type=ARROW_TAG_FIELD),
+        _optional_array(versions, type=pa.int32()),
+        tags.finish(),
         pa.array(nodes, type=pa.list_(pa.int64())),
-        pa.array(timestamps, type=pa.int64()),
-        pa.array(changesets, type=pa.int64()),
-        pa.array(uids, type=pa.int64()),
-        pa.array(user_sids, type=pa.string()),
+        _optional_array(timestamps, type=pa.int64()),
+        _optional_array(changesets, type=pa.int64()),
+        _optional_array(uids, type=pa.int64()),
+        user_sids.finish(),
     ]
 
     return pa.RecordBatch.from_arrays(arrays, schema=ARROW_WAY_SCHEMA)
 
 
-def record_batch_for_relations(relations: Sequence[OsmRelation]) -> pa.RecordBatch | None:
-    if not relations:
+def record_batch_for_relations(relations: Iterable[OsmRelation], count: int) -> pa.RecordBatch | None:
+    if count == 0:
         return None
 
-    ids = [relation.id for relation in relations]
-    versions = [relation.info.version for relation in relations]
-    timestamps = [relation.info.timestamp for relation in relations]
-    changesets = [relation.info.changeset for relation in relations]
-    uids = [relation.info.uid for relation in relations]
-    user_sids = [relation.info.user_sid for relation in relations]
-
-    tags: list[Sequence[tuple[str, str]] | None] = [None] * len(relations)
-    for i, relation in enumerate(relations):
-        if relation.tags is not None:
-            tags[i] = _get_tags_array(relation.tags)
-
-    members: list[list[tuple[int, str, str]] | None] = [None] * len(relations)
+    ids = np.empty(count, dtype=np.int64)
+    versions = np.empty(count, dtype=np.int32)
+    timestamps = np.empty(count, dtype=np.int64)
+    changesets = np.empty(count, dtype=np.int64)
+    uids = np.empty(count, dtype=np.int64)
+    user_sids = _DictionaryBuilder(count)
+    tags = _TagsBuilder(count)
+    member_offsets = np.zeros(count + 1, dtype=np.int32)
+    member_nulls = np.zeros(count, dtype=np.bool_)
+    member_ids: list[int] = []
+    member_roles: list[str] = []
+    member_types: list[str] = []
+
+    i = -1
     for i, relation in enumerate(relations):
-        if relation.members is not None:
-            members[i] = [(m.id, m.role, m.type) for m in relation.members]
+        info = relation.info
+        ids[i] = relation.id
+        versions[i] = info.version or 0
+        timestamps[i] = info.timestamp or 0
+        changesets[i] = info.changeset or 0
+        uids[i] = info.uid or 0
+        user_sids.append(i, info.user_sid)
+        tags.append(i, relation.tags)
+        if relation.members is None:
+            member_nulls[i] = True
+        else:
+            for member in relation.members:
+                member_ids.append(member.id)
+                member_roles.append(member.role)
+                member_types.append(member.type)
+        member_offsets[i + 1] = len(member_ids)
+    _check_count("relations", count, i + 1)
 
     arrays = [
         pa.array(ids, type=pa.int64()),
-        pa.array(versions, type=pa.int32()),
-        pa.array(tags, type=ARROW_TAG_FIELD),
-        pa.array(members, type=ARROW_RELATION_MEMBERS_FIELD),
-        pa.array(timestamps, type=pa.int64()),
-        pa.array(changesets, type=pa.int64()),
-        pa.array(uids, type=pa.int64()),
-        pa.array(user_sids, type=pa.string()),
+        _optional_array(versions, type=pa.int32()),
+        tags.finish(),
+        _members_array(member_offsets, member_ids, member_roles, member_types, member_nulls),
+        _optional_array(timestamps, type=pa.int64()),
+        _optional_array(changesets, type=pa.int64()),
+        _optional_array(uids, type=pa.int64()),
+        user_sids.finish(),
     ]
 
     return pa.RecordBatch.from_arrays(arrays, schema=ARROW_RELATION_SCHEMA)
@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import atexit
+import warnings
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO
 from typing import Iterable
 
+from google.protobuf.internal import api_implementation
 from tqdm import tqdm
 
-from osmpq.arrow import record_batch_for_nodes
+from osmpq.arrow import record_batch_for_node_groups
 from osmpq.arrow import record_batch_for_relations
 from osmpq.arrow import record_batch_for_ways
 from osmpq.io import ElementBatch
@@ -13,32 +20,77 @@ from osmpq.io import ElementsWriter
 from osmpq.io import FileTemplates
 from osmpq.io import WriterConfig
 from osmpq.io import create_output_path
+from osmpq.io import open_pbf
+from osmpq.io import read_blob_from_pbf
+from osmpq.io import read_blob_locations_from_pbf
 from osmpq.io import read_blobs_from_pbf
 from osmpq.io import write_header_as_json
 from osmpq.osm.blob import BlobData
+from osmpq.osm.blob import BlobLocation
 from osmpq.osm.blob import BlobType
+from osmpq.osm.blob import decode_blob_data_ahead
 from osmpq.osm.blob import decode_primtive_blob
+from osmpq.osm.blob import read_blob_at
 from osmpq.osm.elements import PrimitiveBlockDecoder
-from osmpq.osm.elements import decode_nodes
+from osmpq.osm.elements import count_relations
+from osmpq.osm.elements import count_ways
+from osmpq.osm.elements import decode_node_groups
 from osmpq.osm.elements import decode_relations
 from osmpq.osm.elements import decode_ways
+from osmpq.protos.osmformat_pb2 import PrimitiveBlock
 
 
-def to_record_batch(blob_data: bytes) -> ElementBatch:
-    block = decode_primtive_blob(bytes(blob_data))
+def block_to_record_batch(block: PrimitiveBlock) -> ElementBatch:
     decoder = PrimitiveBlockDecoder(block)
 
-    nodes = record_batch_for_nodes(list(decode_nodes(decoder)))
-    ways = record_batch_for_ways(list(decode_ways(decoder)))
-    relations = record_batch_for_relations(list(decode_relations(decoder)))
+    nodes = record_batch_for_node_groups(decode_node_groups(decoder), decoder.string_table)
+    ways = record_batch_for_ways(decode_ways(decoder), count_ways(decoder))
+    relations = record_batch_for_relations(decode_relations(decoder), count_relations(decoder))
 
     return ElementBatch(nodes=nodes, ways=ways, relations=relations)
 
 
-def to_record_batches(blobs: Iterable[BlobData]) -> Iterable[ElementBatch]:
-    for blob_data in blobs:
-        if blob_data.header.type == BlobType.OSM_DATA:
-            yield to_record_batch(blob_data.blob_data)
+def to_record_batch(blob_data: bytes) -> ElementBatch:
+    return block_to_record_batch(decode_primtive_blob(blob_data))
+
+
+_worker_source: BinaryIO | None = None
+
+
+def _init_worker(pbf_filename: str) -> None:
+    global _worker_source
+    _worker_source = open_pbf(pbf_filename)
+    atexit.register(_worker_source.close)
+
+
+def _to_record_batch_at(offset: int, size: int) -> ElementBatch:
+    assert _worker_source is not None
+    return to_record_batch(read_blob_at(_worker_source, offset, size))
+
+
+def to_record_batches_parallel(
+    pbf_filename: str, locations: Iterable[BlobLocation], workers: int
+) -> Iterable[ElementBatch]:
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pbf_filename,))
+    pending: deque[Future[ElementBatch]] = deque()
+    try:
+        for location in locations:
+            if location.header.type != BlobType.OSM_DATA:
+                continue
+            pending.append(executor.submit(_to_record_batch_at, location.offset, location.size))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def to_record_batches(blobs: Iterable[BlobData], decompress_threads: int = 1) -> Iterable[ElementBatch]:
+    data_blobs = (blob.blob_data for blob in blobs if blob.header.type == BlobType.OSM_DATA)
+    for data in decode_blob_data_ahead(data_blobs, workers=decompress_threads):
+        yield block_to_record_batch(PrimitiveBlock.FromString(data))
 
 
 def header_extractor(blobs: Iterable[BlobData], filename: str) -> Iterable[BlobData]:
@@ -49,20 +101,46 @@ def header_extractor(blobs: Iterable[BlobData], filename: str) -> Iterable[BlobD
         yield blob
 
 
+def header_location_extractor(
+    locations: Iterable[BlobLocation], pbf_filename: str, filename: str
+) -> Iterable[BlobLocation]:
+    for location in locations:
+        if location.header.type == BlobType.OSM_HEADER.value:
+            write_header_as_json(filename, read_blob_from_pbf(pbf_filename, location))
+
+        yield location
+
+
 def pbf_to_elements_parquet(
     pbf_filename: str,
     output_path: str,
     header_output_filename: str | None,
     writer_config: WriterConfig,
     file_templates: FileTemplates | None = None,
+    workers: int = 1,
+    decompress_threads: int = 1,
 ) -> None:
-    create_output_path(output_path)
-    blobs = read_blobs_from_pbf(pbf_filename)
-    if header_output_filename is not None:
-        blobs = header_extractor(blobs, header_output_filename)
+    if workers > 1 and decompress_threads > 1:
+        raise ValueError("decompress_threads can only be used with a single worker")
+    if api_implementation.Type() == "python":
+        warnings.warn(
+            "protobuf uses its pure Python implementation, decoding PBF blobs will be very slow",
+            RuntimeWarning,
+            stacklevel=2,
+        )
 
-    # blobs = tqdm(blobs, desc="Processing blobs", unit_scale=True)
-    batches = to_record_batches(blobs)
+    create_output_path(output_path)
+    batches: Iterable[ElementBatch]
+    if workers > 1:
+        locations = read_blob_locations_from_pbf(pbf_filename)
+        if header_output_filename is not None:
+            locations = header_location_extractor(locations, pbf_filename, header_output_filename)
+        batches = to_record_batches_parallel(pbf_filename, locations, workers)
+    else:
+        blobs = read_blobs_from_pbf(pbf_filename)
+        if header_output_filename is not None:
+            blobs = header_extractor(blobs, header_output_filename)
+        batches = to_record_batches(blobs, decompress_threads=decompress_threads)
 
     writer = ElementsWriter(
         path=output_path,
@@ -71,7 +149,7 @@ def pbf_to_elements_parquet(
     )
 
     count = ElementCount()
-    with writer, tqdm(desc="Writing batches", unit="rows", unit_scale=True) as pbar:
+    with writer, tqdm(desc="Writing batches", unit="rows", unit_scale=True, mininterval=0.5) as pbar:
         for batch in batches:
             writer.write(batch)
             count += batch.count
@@ -3,8 +3,11 @@ from __future__ import annotations
 import hashlib
 import json
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from dataclasses import field
 from typing import Any
+from typing import BinaryIO
 from typing import Iterable
 
 import fsspec
@@ -16,7 +19,10 @@ from osmpq.arrow import ARROW_NODE_SCHEMA
 from osmpq.arrow import ARROW_RELATION_SCHEMA
 from osmpq.arrow import ARROW_WAY_SCHEMA
 from osmpq.osm.blob import BlobData
+from osmpq.osm.blob import BlobLocation
 from osmpq.osm.blob import decode_header_blob_to_dict
+from osmpq.osm.blob import read_blob_at
+from osmpq.osm.blob import read_blob_locations
 from osmpq.osm.blob import read_blobs
 
 
@@ -25,11 +31,28 @@ def get_fs(path: str) -> tuple[AbstractFileSystem, str]:
     return fs, base_path
 
 
+PBF_BLOCK_SIZE = 16 * 1024 * 1024
+
+
 def read_blobs_from_pbf(filename: str) -> Iterable[BlobData]:
-    with fsspec.open(filename, "rb") as fin:
+    with fsspec.open(filename, "rb", cache_type="readahead", block_size=PBF_BLOCK_SIZE) as fin:
         yield from read_blobs(fin)
 
 
+def open_pbf(filename: str) -> BinaryIO:
+    return fsspec.open(filename, "rb").open()
+
+
+def read_blob_locations_from_pbf(filename: str) -> Iterable[BlobLocation]:
+    with fsspec.open(filename, "rb") as fin:
+        yield from read_blob_locations(fin)
+
+
+def read_blob_from_pbf(filename: str, location: BlobLocation) -> bytes:
+    with fsspec.open(filename, "rb") as fin:
+        return read_blob_at(fin, location.offset, location.size)
+
+
 def write_header_as_json(filename: str, blob_data: bytes) -> None:
     header = decode_header_blob_to_dict(blob_data)
 
@@ -48,39 +71,116 @@ def clear_output_path(path: str) -> None:
         fs.rm(base_path, recursive=True)
 
 
+# Parquet column paths of the element schemas
+DELTA_ENCODED_COLUMNS = [
+    "id",
+    "timestamp",
+    "changeset",
+    "uid",
+    "nodes.list.element",
+    "members.list.element.id",
+]
+DICTIONARY_ENCODED_COLUMNS = [
+    "version",
+    "user_sid",
+    "tags.key_value.key",
+    "tags.key_value.value",
+    "members.list.element.role",
+    "members.list.element.type",
+]
+
+
+def _columns_in_schema(columns: list[str], schema: pa.Schema) -> list[str]:
+    return [column for column in columns if column.split(".")[0] in schema.names]
+
+
 @dataclass
 class WriterConfig:
     max_rows_per_row_group: int | None = None
     max_rows_per_file: int | None = None
     max_file_size_bytes: int | None = None
+    write_batch_size: int = 8192
+    compression: str = "zstd"
+    compression_level: int | None = 3
+    data_page_size: int = 1024 * 1024
+    max_buffer_bytes: int = 64 * 1024 * 1024
+    parquet_version: str = "2.6"
+    data_page_version: str = "2.0"
 
 
 @dataclass
 class Writer:
     writer: pq.ParquetWriter
+    config: WriterConfig
     written_rows: int = 0
     written_batches: int = 0
     written_bytes: int = 0
+    pending: list[pa.RecordBatch] = field(default_factory=list)
+    pending_bytes: int = 0
 
     @classmethod
-    def create(cls, filename: str, schema: pa.Schema) -> Writer:
-        fs, path = get_fs(filename)
+    def create(cls, fs: AbstractFileSystem, path: str, schema: pa.Schema, config: WriterConfig) -> Writer:
         writer = pq.ParquetWriter(
             path,
             schema=schema,
-            flavor="spark",
             filesystem=fs,
-            compression="zstd",
+            version=config.parquet_version,
+            data_page_version=config.data_page_version,
+            compression=config.compression,
+            compression_level=config.compression_level,
+            data_page_size=config.data_page_size,
+            write_batch_size=config.write_batch_size,
+            use_dictionary=_columns_in_schema(DICTIONARY_ENCODED_COLUMNS, schema),
+            column_encoding={
+                column: "DELTA_BINARY_PACKED" for column in _columns_in_schema(DELTA_ENCODED_COLUMNS, schema)
+            },
         )
-        return cls(writer=writer)
+        return cls(writer=writer, config=config)
 
     def write(self, batch: pa.RecordBatch) -> None:
-        self.writer.write_batch(batch)
+        size = batch.get_total_buffer_size()
+        self.pending.append(batch)
+        self.pending_bytes += size
         self.written_rows += batch.num_rows
         self.written_batches += 1
-        self.written_bytes += batch.nbytes
+        self.written_bytes += size
+
+        if self.pending_bytes >= self.config.max_buffer_bytes:
+            self.flush()
+
+    def fits(self, batch: pa.RecordBatch) -> bool:
+        max_size = self.config.max_file_size_bytes
+        if max_size is None or self.written_batches == 0:
+            return True
+        pending_bytes = self.pending_bytes + batch.get_total_buffer_size()
+        if pending_bytes > max_size and self.written_bytes == self.pending_bytes:
+            # Nothing is flushed yet, write a row group to learn the compression ratio
+            self.flush()
+            pending_bytes = batch.get_total_buffer_size()
+        return self._estimate_file_size(pending_bytes) <= max_size
+
+    @property
+    def estimated_file_size(self) -> int:
+        return self._estimate_file_size(self.pending_bytes)
+
+    def _estimate_file_size(self, pending_bytes: int) -> int:
+        file_size = self.writer.file_handle.tell()
+        flushed_bytes = self.written_bytes - self.pending_bytes
+        if flushed_bytes == 0:
+            return file_size + pending_bytes
+        # Scale the buffered batches by the compression ratio achieved so far
+        return file_size + pending_bytes * file_size // flushed_bytes
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        table = pa.Table.from_batches(self.pending)
+        self.writer.write_table(table, row_group_size=self.config.max_rows_per_row_group)
+        self.pending = []
+        self.pending_bytes = 0
 
     def close(self) -> None:
+        self.flush()
         self.writer.close()
 
 
@@ -92,16 +192,21 @@ class MultiParquetWriter:
         self.writer_config = config
         self._file_index = 0
 
+        self._fs, self._base_path = get_fs(path)
+        self._path_prefix = os.path.join(self._base_path, "")
         self._writer: Writer | None = None
 
     def _get_writer(self) -> Writer:
         if self._writer is None:
+            if self._file_index == 0:
+                self._fs.makedirs(self._base_path, exist_ok=True)
             self._file_index += 1
-            create_output_path(self.path)
-            filename = os.path.join(self.path, self.filename_template.format(index=self._file_index))
+            filename = self._path_prefix + self.filename_template.format(index=self._file_index)
             self._writer = Writer.create(
-                filename=filename,
+                fs=self._fs,
+                path=filename,
                 schema=self.schema,
+                config=self.writer_config,
             )
 
         return self._writer
@@ -109,6 +214,8 @@ class MultiParquetWriter:
     def write(self, batch: pa.RecordBatch | None) -> None:
         if batch is None or batch.num_rows == 0:
             return
+        if self._writer is not None and not self._writer.fits(batch):
+            self.close()
         writer = self._get_writer()
         writer.write(batch)
         if self._should_switch_writer():
@@ -123,7 +230,7 @@ class MultiParquetWriter:
                 return True
 
         if self.writer_config.max_file_size_bytes is not None:
-            if self._writer.written_bytes >= self.writer_config.max_file_size_bytes:
+            if self._writer.estimated_file_size >= self.writer_config.max_file_size_bytes:
                 return True
 
         return False
@@ -219,16 +326,31 @@ class ElementsWriter:
             schema=ARROW_RELATION_SCHEMA,
             config=config,
         )
+        self._executor = ThreadPoolExecutor(max_workers=3)
 
     def write(self, batch: ElementBatch) -> None:
-        self.nodes.write(batch.nodes)
-        self.ways.write(batch.ways)
-        self.relations.write(batch.relations)
+        futures = [
+            self._executor.submit(self.nodes.write, batch.nodes),
+            self._executor.submit(self.ways.write, batch.ways),
+            self._executor.submit(self.relations.write, batch.relations),
+        ]
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        futures = [
+            self._executor.submit(self.nodes.close),
+            self._executor.submit(self.ways.close),
+            self._executor.submit(self.relations.close),
+        ]
+        for future in futures:
+            future.result()
 
     def __enter__(self) -> ElementsWriter:
         return self
 
     def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
-        self.nodes.close()
-        self.ways.close()
-        self.relations.close()
+        try:
+            self.close()
+        finally:
+            self._executor.shutdown()
@@ -153,6 +153,20 @@ def split_command(
 @main.command(name="elements")
 @pbf_input_options
 @writer_options
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of processes used to decode PBF blobs.",
+)
+@click.option(
+    "--decompress-threads",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of threads decompressing PBF blobs ahead of decoding when using a single process.",
+)
 def osm_elements_command(
     pbf_filename: str,
     output_path: str,
@@ -160,16 +174,30 @@ def osm_elements_command(
     max_rows_per_row_group: int | None,
     max_rows_per_file: int | None,
     max_file_size_mb: int,
+    workers: int,
+    decompress_threads: int,
 ) -> None:
     """Convert OSM PBF data into elements (nodes, ways, relations) Parquet files."""
     from osmpq.elements import pbf_to_elements_parquet
 
+    if workers > 1 and decompress_threads > 1:
+        raise click.BadOptionUsage(
+            "decompress_threads", "--decompress-threads can only be used with a single worker (--workers 1)."
+        )
+
     writer_config = build_writer_config(
         max_rows_per_row_group=max_rows_per_row_group,
         max_rows_per_file=max_rows_per_file,
         max_file_size_mb=max_file_size_mb,
     )
-    pbf_to_elements_parquet(pbf_filename, output_path, header_output_filename, writer_config)
+    pbf_to_elements_parquet(
+        pbf_filename,
+        output_path,
+        header_output_filename,
+        writer_config,
+        workers=workers,
+        decompress_threads=decompress_threads,
+    )
 
 
 if __name__ == "__main__":
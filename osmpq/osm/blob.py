@@ -1,11 +1,18 @@
 from __future__ import annotations
 
-import zlib
+import io
+import os
+import threading
+from collections import deque
 from collections.abc import Generator
+from collections.abc import Iterable
 from compression import zstd
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import StrEnum
 from typing import BinaryIO
+from typing import cast
 
 from google.protobuf.json_format import MessageToDict
 
@@ -14,6 +21,17 @@ from osmpq.protos.fileformat_pb2 import BlobHeader
 from osmpq.protos.osmformat_pb2 import HeaderBlock
 from osmpq.protos.osmformat_pb2 import PrimitiveBlock
 
+try:
+    from isal import isal_zlib as zlib
+except ImportError:
+    import zlib  # type: ignore[no-redef]
+
+READ_BUFFER_SIZE = 1024 * 1024
+INFLATE_BUFFER_SIZE = 16 * 1024
+
+# Blob messages never leave this module, so each thread reuses one instance for parsing
+_thread_local = threading.local()
+
 
 class BlobType(StrEnum):
     OSM_HEADER = "OSMHeader"
@@ -42,7 +60,10 @@ def read_blob_data(source: BinaryIO) -> BlobData | None:
     return BlobData(header=blob_header, header_data=header_data, blob_data=blob_data)
 
 
-def read_blobs(source: BinaryIO) -> Generator[BlobData, None, None]:
+def read_blobs(source: BinaryIO, buffer_size: int = READ_BUFFER_SIZE) -> Generator[BlobData, None, None]:
+    if isinstance(source, io.RawIOBase):
+        source = cast(BinaryIO, io.BufferedReader(source, buffer_size=buffer_size))
+
     while True:
         data = read_blob_data(source)
         if data is None:
@@ -50,21 +71,56 @@ def read_blobs(source: BinaryIO) -> Generator[BlobData, None, None]:
         yield data
 
 
+@dataclass(frozen=True)
+class BlobLocation:
+    header: BlobHeader
+    offset: int
+    size: int
+
+
+def read_blob_locations(source: BinaryIO) -> Generator[BlobLocation, None, None]:
+    offset = 0
+    while True:
+        data = source.read(4)
+        if len(data) == 0:
+            return
+
+        header_size = int.from_bytes(data, "big")
+        blob_header = BlobHeader.FromString(source.read(header_size))
+        offset += 4 + header_size
+
+        source.seek(blob_header.datasize, os.SEEK_CUR)
+        yield BlobLocation(header=blob_header, offset=offset, size=blob_header.datasize)
+        offset += blob_header.datasize
+
+
+def read_blob_at(source: BinaryIO, offset: int, size: int) -> bytes:
+    source.seek(offset)
+    return source.read(size)
+
+
 def decompress_blob(blob: Blob) -> bytes:
     match blob.WhichOneof("data"):
         case "raw":
             return blob.raw
         case "zlib_data":
-            return zlib.decompress(blob.zlib_data)
+            return zlib.decompress(blob.zlib_data, bufsize=blob.raw_size or INFLATE_BUFFER_SIZE)
         case "zstd_data":
             return zstd.decompress(blob.zstd_data)
         case _:
             raise ValueError("Blob has no data")
 
 
+def _parse_blob(blob_data: bytes) -> Blob:
+    blob = getattr(_thread_local, "blob", None)
+    if blob is None:
+        blob = _thread_local.blob = Blob()
+    blob.ParseFromString(blob_data)
+    return blob
+
+
 def decode_blob(header: BlobHeader, blob_data: bytes) -> HeaderBlock | PrimitiveBlock:
-    blob = Blob.FromString(blob_data)
-    data = decompress_blob(blob)
+    data = decompress_blob(_parse_blob(blob_data))
     match header.type:
         case BlobType.OSM_HEADER:
             return HeaderBlock.FromString(data)
@@ -75,11 +131,29 @@ def decode_blob(header: BlobHeader, blob_data: bytes) -> HeaderBlock | Primitive
 
 
 def decode_blob_data(blob_data: bytes) -> bytes:
-    blob = Blob.FromString(blob_data)
-    data = decompress_blob(blob)
+    data = decompress_blob(_parse_blob(blob_data))
     return data
 
 
+def decode_blob_data_ahead(blobs: Iterable[bytes], workers: int = 1) -> Generator[bytes, None, None]:
+    if workers <= 1:
+        yield from map(decode_blob_data, blobs)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending: deque[Future[bytes]] = deque()
+    try:
+        for blob_data in blobs:
+            pending.append(executor.submit(decode_blob_data, blob_data))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
 def decode_header_blob(blob_data: bytes) -> HeaderBlock:
     data = decode_blob_data(blob_data)
     return HeaderBlock.FromString(data)
@@ -1,16 +1,20 @@
 from __future__ import annotations
 
+import sys
 from collections.abc import Generator
 from collections.abc import Iterable
 from collections.abc import Sequence
+from itertools import accumulate
 
+import numpy as np
+
+from osmpq.osm.types import DenseNodeColumns
 from osmpq.osm.types import OsmInfo
 from osmpq.osm.types import OsmNode
 from osmpq.osm.types import OsmRelation
 from osmpq.osm.types import OsmRelationMember
 from osmpq.osm.types import OsmTags
 from osmpq.osm.types import OsmWay
-from osmpq.protos.osmformat_pb2 import DenseInfo
 from osmpq.protos.osmformat_pb2 import DenseNodes
 from osmpq.protos.osmformat_pb2 import Info
 from osmpq.protos.osmformat_pb2 import Node
@@ -18,12 +22,38 @@ from osmpq.protos.osmformat_pb2 import PrimitiveBlock
 from osmpq.protos.osmformat_pb2 import Relation
 from osmpq.protos.osmformat_pb2 import Way
 
+_MEMBER_TYPE_NAMES = {
+    value: sys.intern(Relation.MemberType.Name(value).lower()) for value in Relation.MemberType.values()
+}
+
+
+def delta_decode(values: Iterable[int]) -> list[int]:
+    return list(accumulate(values))
+
+
+def delta_decode_array(values: Sequence[int]) -> np.ndarray:
+    decoded = np.fromiter(values, dtype=np.int64, count=len(values))
+    return np.cumsum(decoded, out=decoded)
 
-def delta_decode(values: Iterable[int]) -> Generator[int, None, None]:
-    current = 0
-    for value in values:
-        current += value
-        yield current
+
+def _dedupe_tags(
+    keys: np.ndarray, values: np.ndarray, offsets: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Like the tag dicts of the other elements, a repeated key of a node keeps its first position and last value
+    count = len(offsets) - 1
+    nodes = np.repeat(np.arange(count, dtype=np.int64), np.diff(offsets))
+    node_keys = nodes * (int(keys.max(initial=0)) + 1) + keys
+    sorted_keys = np.sort(node_keys)
+    if not np.any(sorted_keys[1:] == sorted_keys[:-1]):
+        return keys, values, offsets
+
+    _, first, inverse = np.unique(node_keys, return_index=True, return_inverse=True)
+    last = np.zeros(len(first), dtype=np.intp)
+    np.maximum.at(last, inverse, np.arange(len(keys)))
+    order = np.argsort(first)
+    deduped_offsets = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(np.bincount(nodes[first], minlength=count), out=deduped_offsets[1:])
+    return keys[first[order]], values[last[order]], deduped_offsets
 
 
 class ValueDecoder:
@@ -39,6 +69,17 @@ class ValueDecoder:
     def lon(self, value: int) -> float:
         return 0.000000001 * (self.lon_offset + (self.granularity * value))
 
+    def lats(self, values: np.ndarray) -> np.ndarray:
+        return self._coordinates(values, self.lat_offset)
+
+    def lons(self, values: np.ndarray) -> np.ndarray:
+        return self._coordinates(values, self.lon_offset)
+
+    def _coordinates(self, values: np.ndarray, offset: int) -> np.ndarray:
+        np.multiply(values, self.granularity, out=values)
+        np.add(values, offset, out=values)
+        return np.multiply(values, 0.000000001)
+
     def timestamp(self, value: int) -> int:
         return value * self.date_granularity
 
@@ -46,25 +87,21 @@ class ValueDecoder:
 class PrimitiveBlockDecoder:
     def __init__(self, block: PrimitiveBlock) -> None:
         self.block = block
-        self.string_table = [s.decode("utf-8") for s in block.stringtable.s]
+        self.string_table = [sys.intern(s.decode("utf-8")) for s in block.stringtable.s]
         self.value_decoder = ValueDecoder(block)
 
-    def decode_string(self, index: int) -> str:
-        return self.string_table[index]
-
     def decode_info(self, info: Info) -> OsmInfo:
         return OsmInfo(
             version=info.version or None,
             timestamp=info.timestamp or None,
             changeset=info.changeset or None,
             uid=info.uid or None,
-            user_sid=self.decode_string(info.user_sid) if info.user_sid else None,
+            user_sid=self.string_table[info.user_sid] if info.user_sid else None,
         )
 
     def decode_tags(self, keys: Iterable[int], vals: Iterable[int]) -> OsmTags:
-        k = (self.decode_string(key) for key in keys)
-        v = (self.decode_string(val) for val in vals)
-        return OsmTags(zip(k, v))
+        lookup = self.string_table.__getitem__
+        return OsmTags(zip(map(lookup, keys), map(lookup, vals)))
 
     def decode_node(self, node: Node) -> OsmNode:
         return OsmNode(
@@ -75,63 +112,53 @@ class PrimitiveBlockDecoder:
             longitude=self.value_decoder.lon(node.lon),
         )
 
-    def decode_dense_info(self, dense: DenseInfo) -> Generator[OsmInfo, None, None]:
-        for version, timestamp, changeset, uid, user_sid in zip(
-            dense.version,
-            delta_decode(dense.timestamp),
-            delta_decode(dense.changeset),
-            delta_decode(dense.uid),
-            delta_decode(dense.user_sid),
-        ):
-            yield OsmInfo(
-                version=version or None,
-                timestamp=timestamp or None,
-                changeset=changeset or None,
-                uid=uid or None,
-                user_sid=self.decode_string(user_sid) if user_sid else None,
-            )
-
-    def decode_dense_tags(self, keys_vals: Sequence[int]) -> Generator[OsmTags, None, None]:
-        i = 0
-        tags = OsmTags()
-        while i < len(keys_vals):
-            if keys_vals[i] == 0:
-                yield tags
-                tags = OsmTags()
-                i += 1
-            else:
-                key = self.decode_string(keys_vals[i])
-                value = self.decode_string(keys_vals[i + 1])
-                i += 2
-                tags[key] = value
-
-        assert not tags
-
-    def decode_dense_nodes(self, dense: DenseNodes) -> Generator[OsmNode, None, None]:
-        for id, info, tags, lat, lon in zip(
-            delta_decode(dense.id),
-            self.decode_dense_info(dense.denseinfo),
-            self.decode_dense_tags(dense.keys_vals),
-            delta_decode(dense.lat),
-            delta_decode(dense.lon),
-        ):
-            yield OsmNode(
-                id=id,
-                info=info,
-                tags=tags or None,
-                latitude=self.value_decoder.lat(lat),
-                longitude=self.value_decoder.lon(lon),
-            )
+    def decode_dense_node_columns(self, dense: DenseNodes) -> DenseNodeColumns:
+        count = len(dense.id)
+        if dense.HasField("denseinfo"):
+            info = dense.denseinfo
+            versions = np.fromiter(info.version, dtype=np.int32, count=count)
+            timestamps = delta_decode_array(info.timestamp)
+            changesets = delta_decode_array(info.changeset)
+            uids = delta_decode_array(info.uid)
+            user_sids = delta_decode_array(info.user_sid).astype(np.int32)
+        else:
+            versions = user_sids = np.zeros(count, dtype=np.int32)
+            timestamps = changesets = uids = np.zeros(count, dtype=np.int64)
+
+        # Keys and values are never the empty string at index zero, so without the node terminators
+        # the remaining indices alternate between keys and values across all nodes
+        keys_vals = np.fromiter(dense.keys_vals, dtype=np.int32, count=len(dense.keys_vals))
+        tag_offsets = np.zeros(count + 1, dtype=np.int32)
+        if len(keys_vals) > 0:
+            ends = np.flatnonzero(keys_vals == 0)
+            tag_offsets[1:] = (ends - np.arange(count)) // 2
+        pairs = keys_vals[keys_vals != 0].reshape(-1, 2)
+        tag_keys, tag_values, tag_offsets = _dedupe_tags(pairs[:, 0], pairs[:, 1], tag_offsets)
+
+        return DenseNodeColumns(
+            ids=delta_decode_array(dense.id),
+            latitudes=self.value_decoder.lats(delta_decode_array(dense.lat)),
+            longitudes=self.value_decoder.lons(delta_decode_array(dense.lon)),
+            versions=versions,
+            timestamps=timestamps,
+            changesets=changesets,
+            uids=uids,
+            user_sids=user_sids,
+            tag_offsets=tag_offsets,
+            tag_keys=np.ascontiguousarray(tag_keys),
+            tag_values=np.ascontiguousarray(tag_values),
+        )
 
     def decode_way(self, way: Way) -> OsmWay:
         return OsmWay(
             id=way.id,
             info=self.decode_info(way.info),
             tags=self.decode_tags(way.keys, way.vals),
-            nodes=list(delta_decode(way.refs)),
+            nodes=delta_decode(way.refs),
         )
 
     def decode_relation(self, relation: Relation) -> OsmRelation:
+        string_table = self.string_table
         return OsmRelation(
             id=relation.id,
             info=self.decode_info(relation.info),
@@ -139,8 +166,8 @@ class PrimitiveBlockDecoder:
             members=[
                 OsmRelationMember(
                     id=member_id,
-                    role=self.decode_string(role_sid),
-                    type=Relation.MemberType.Name(member_type).lower(),
+                    role=string_table[role_sid],
+                    type=_MEMBER_TYPE_NAMES[member_type],
                 )
                 for role_sid, member_id, member_type in zip(
                     relation.roles_sid, delta_decode(relation.memids), relation.types
@@ -149,13 +176,12 @@ class PrimitiveBlockDecoder:
         )
 
 
-def decode_nodes(decoder: PrimitiveBlockDecoder) -> Generator[OsmNode, None, None]:
+def decode_node_groups(decoder: PrimitiveBlockDecoder) -> Generator[list[OsmNode] | DenseNodeColumns, None, None]:
     for group in decoder.block.primitivegroup:
-        for node in group.nodes:
-            yield decoder.decode_node(node)
-
-        if group.dense is not None:
-            yield from decoder.decode_dense_nodes(group.dense)
+        if len(group.nodes) > 0:
+            yield [decoder.decode_node(node) for node in group.nodes]
+        if len(group.dense.id) > 0:
+            yield decoder.decode_dense_node_columns(group.dense)
 
 
 def decode_ways(decoder: PrimitiveBlockDecoder) -> Generator[OsmWay, None, None]:
@@ -168,3 +194,11 @@ def decode_relations(decoder: PrimitiveBlockDecoder) -> Generator[OsmRelation, N
     for group in decoder.block.primitivegroup:
         for relation in group.relations:
             yield decoder.decode_relation(relation)
+
+
+def count_ways(decoder: PrimitiveBlockDecoder) -> int:
+    return sum(len(group.ways) for group in decoder.block.primitivegroup)
+
+
+def count_relations(decoder: PrimitiveBlockDecoder) -> int:
+    return sum(len(group.relations) for group in decoder.block.primitivegroup)
@@ -2,10 +2,12 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 
+import numpy as np
+
 OsmTags = dict[str, str]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OsmInfo:
     version: int | None
     timestamp: int | None
@@ -18,7 +20,7 @@ class OsmInfo:
         return cls(None, None, None, None, None)
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OsmNode:
     id: int
     info: OsmInfo
@@ -27,7 +29,7 @@ class OsmNode:
     longitude: float
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OsmWay:
     id: int
     info: OsmInfo
@@ -35,16 +37,32 @@ class OsmWay:
     nodes: list[int]
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OsmRelationMember:
     id: int
     role: str
     type: str
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class OsmRelation:
     id: int
     info: OsmInfo
     tags: OsmTags | None
     members: list[OsmRelationMember]
+
+
+@dataclass(frozen=True, slots=True)
+class DenseNodeColumns:
+    # Strings are given as string table indices, absent values as zero
+    ids: np.ndarray
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    versions: np.ndarray
+    timestamps: np.ndarray
+    changesets: np.ndarray
+    uids: np.ndarray
+    user_sids: np.ndarray
+    tag_offsets: np.ndarray
+    tag_keys: np.ndarray
+    tag_values: np.ndarray
@@ -69,7 +69,7 @@ def split_pbf(pbf_filename: str, output_folder: str, max_file_size_bytes: int) -
         fsspec.open(pbf_filename, "rb", cache_type="readahead") as fin,
     ):
         blobs = read_blobs(fin)
-        with tqdm(desc="Writing blobs", unit="B", unit_scale=True) as pbar:
+        with tqdm(desc="Writing blobs", unit="B", unit_scale=True, mininterval=0.5) as pbar:
             for blob in blobs:
                 size = writer.write(blob)
                 pbar.update(size)